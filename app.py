@@ -1,13 +1,17 @@
 import streamlit as st
+import io
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import folium
-from folium.plugins import HeatMap, MarkerCluster
+from folium.plugins import HeatMap, FastMarkerCluster
 import numpy as np
-from scipy.interpolate import griddata
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from datetime import datetime
+import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import warnings
 import urllib3
 warnings.filterwarnings('ignore')
@@ -80,131 +84,212 @@ ciudades = PAISES_CONFIG.get(pais_seleccionado, PAISES_CONFIG['Argentina'])
 
 st.sidebar.info(f"📊 Se consultarán {len(ciudades)} ciudades de {pais_seleccionado}")
 
+# ============================================
+# SESIÓN HTTP COMPARTIDA
+# ============================================
+# Una sola sesión reutiliza las conexiones TCP/TLS (keep-alive) entre ciudades, hilos y reruns;
+# los reintentos ante errores transitorios los resuelve el adaptador
+@st.cache_resource
+def obtener_sesion():
+    """Crea la sesión HTTP compartida (una por proceso, no se reconstruye en cada rerun)"""
+    sesion = requests.Session()
+    sesion.mount("https://", HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False
+        )
+    ))
+    return sesion
+
+SESSION = obtener_sesion()
+
+ERROR_LIMITE = "Límite de solicitudes excedido"
+
+class ErrorConsulta(Exception):
+    """Error de una consulta a OpenWeatherMap (con el mensaje que se muestra al usuario)"""
+
+def consultar_api(url, params, ciudad):
+    """Realiza una consulta a OpenWeatherMap y traduce los códigos de error"""
+    # Los errores se lanzan en lugar de devolverse: las cachés no guardan excepciones, así
+    # que un timeout o un 429 no se sirve de nuevo durante el resto de la ventana
+    try:
+        try:
+            response = SESSION.get(url, params=params, timeout=10)
+        except requests.exceptions.SSLError:
+            response = SESSION.get(url, params=params, timeout=10, verify=False)
+    except requests.exceptions.Timeout:
+        raise ErrorConsulta("Timeout en la solicitud")
+    except requests.exceptions.RequestException as e:
+        raise ErrorConsulta(f"Error de conexión: {str(e)}")
+    
+    if response.status_code == 200:
+        return response.json()
+    elif response.status_code == 401:
+        raise ErrorConsulta("API Key inválida")
+    elif response.status_code == 404:
+        raise ErrorConsulta(f"Ciudad '{ciudad}' no encontrada")
+    elif response.status_code == 429:
+        raise ErrorConsulta(ERROR_LIMITE)
+    raise ErrorConsulta(f"Error {response.status_code}")
+
+def consultar(funcion, *args):
+    """Ejecuta una consulta (cacheada) y devuelve la tupla (datos, error)"""
+    try:
+        return funcion(*args), None
+    except ErrorConsulta as e:
+        return None, str(e)
+
+# ============================================
+# CACHÉ DE RESPUESTAS DE LA API
+# ============================================
+# Las respuestas se persisten en disco para sobrevivir a reinicios del servidor. Streamlit
+# ignora el ttl de las cachés persistidas, por eso la vigencia se controla con una ventana
+# de tiempo que forma parte de la clave de caché: al cambiar la ventana se consulta de nuevo
+DURACION_CACHE = 600  # segundos
+DURACION_PRONOSTICO = 3 * 3600  # el pronóstico de 5 días se actualiza cada 3 horas
+
+def ventana_cache(duracion=DURACION_CACHE):
+    """Número de la ventana de vigencia actual de las respuestas cacheadas"""
+    return int(time.time() // duracion)
+
+@st.cache_resource
+def ventana_activa():
+    """Últimas ventanas de caché (clima actual y pronóstico) usadas por este proceso"""
+    return {'ventana': None, 'ventana_pronostico': None}
+
+@st.cache_resource
+def refrescos():
+    """Cantidad de veces que se forzó una nueva consulta de cada país en este proceso"""
+    return {}
+
 # ============================================
 # FUNCIÓN PARA OBTENER DATOS METEOROLÓGICOS
 # ============================================
-def obtener_clima(ciudad, api_key, max_reintentos=3):
+@st.cache_data(persist="disk", max_entries=512, show_spinner=False)
+def obtener_clima(ciudad, _api_key, ventana):
     """Obtiene datos meteorológicos de una ciudad con manejo de errores"""
-    url = "https://api.openweathermap.org/data/2.5/weather"
+    return _fetch_clima_raw(ciudad, _api_key, ventana)
+
+# Capa LRU en memoria del proceso por debajo de la caché de Streamlit (solo se consulta
+# cuando obtener_clima no encuentra la entrada). Streamlit vuelve a ejecutar todo el script
+# en cada rerun: un @lru_cache a nivel de módulo se redefiniría vacío cada vez y nunca
+# acertaría. Por eso la función decorada se crea dentro de un cache_resource, que la
+# conserva una sola vez por proceso y la comparte entre reruns y sesiones
+@st.cache_resource
+def capa_lru_clima():
+    """Función de consulta del clima actual envuelta en un lru_cache compartido"""
+    @lru_cache(maxsize=512)
+    def _fetch_clima_raw(ciudad, api_key, ventana):
+        """Consulta el clima actual de una ciudad en la API"""
+        # consultar_api lanza ErrorConsulta ante cualquier error y lru_cache no guarda
+        # excepciones: solo las respuestas correctas quedan en esta capa
+        url = "https://api.openweathermap.org/data/2.5/weather"
+        params = {
+            "q": ciudad,
+            "appid": api_key,
+            "units": "metric",
+            "lang": "es"
+        }
+        return consultar_api(url, params, ciudad)
+    return _fetch_clima_raw
+
+_fetch_clima_raw = capa_lru_clima()
+
+# ============================================
+# FUNCIÓN PARA OBTENER DATOS DE VARIAS CIUDADES EN UNA CONSULTA
+# ============================================
+@st.cache_resource
+def ids_ciudades():
+    """Identificadores numéricos de OpenWeatherMap de cada ciudad ya consultada (no cambian)"""
+    return {}
+
+@st.cache_resource
+def consultas_individuales():
+    """Ventana en que quedó en caché el clima actual de cada ciudad consultada individualmente"""
+    return {}
+
+@st.cache_data(persist="disk", max_entries=512, show_spinner=False)
+def obtener_clima_grupo(ids, _api_key, ventana):
+    """Obtiene datos meteorológicos de hasta 20 ciudades (por id) en una sola consulta"""
+    url = "https://api.openweathermap.org/data/2.5/group"
     params = {
-        "q": ciudad,
-        "appid": api_key,
+        "id": ",".join(str(id_ciudad) for id_ciudad in ids),
+        "appid": _api_key,
         "units": "metric",
         "lang": "es"
     }
-    
-    for intento in range(max_reintentos):
-        try:
-            try:
-                response = requests.get(url, params=params, timeout=10)
-            except requests.exceptions.SSLError:
-                response = requests.get(url, params=params, timeout=10, verify=False)
-            
-            if response.status_code == 200:
-                return response.json(), None
-            elif response.status_code == 401:
-                return None, "API Key inválida"
-            elif response.status_code == 404:
-                return None, f"Ciudad '{ciudad}' no encontrada"
-            elif response.status_code == 429:
-                return None, "Límite de solicitudes excedido"
-            else:
-                if intento < max_reintentos - 1:
-                    continue
-                return None, f"Error {response.status_code}"
-                
-        except requests.exceptions.Timeout:
-            if intento < max_reintentos - 1:
-                continue
-            return None, "Timeout en la solicitud"
-        except requests.exceptions.RequestException as e:
-            return None, f"Error de conexión: {str(e)}"
-    
-    return None, "Error después de múltiples intentos"
+    return consultar_api(url, params, "grupo de ciudades")
 
 # ============================================
 # FUNCIÓN PARA OBTENER PRONÓSTICO
 # ============================================
-def obtener_pronostico(ciudad, api_key, max_reintentos=3):
+@st.cache_data(persist="disk", max_entries=512, show_spinner=False)
+def obtener_pronostico(ciudad, _api_key, ventana_pronostico):
     """Obtiene pronóstico meteorológico de 5 días para una ciudad"""
     url = "https://api.openweathermap.org/data/2.5/forecast"
     params = {
         "q": ciudad,
-        "appid": api_key,
+        "appid": _api_key,
         "units": "metric",
         "lang": "es",
         "cnt": 40  # 40 períodos = 5 días (cada 3 horas)
     }
-    
-    for intento in range(max_reintentos):
-        try:
-            try:
-                response = requests.get(url, params=params, timeout=10)
-            except requests.exceptions.SSLError:
-                response = requests.get(url, params=params, timeout=10, verify=False)
-            
-            if response.status_code == 200:
-                return response.json(), None
-            elif response.status_code == 401:
-                return None, "API Key inválida"
-            elif response.status_code == 404:
-                return None, f"Ciudad '{ciudad}' no encontrada"
-            elif response.status_code == 429:
-                return None, "Límite de solicitudes excedido"
-            else:
-                if intento < max_reintentos - 1:
-                    continue
-                return None, f"Error {response.status_code}"
-                
-        except requests.exceptions.Timeout:
-            if intento < max_reintentos - 1:
-                continue
-            return None, "Timeout en la solicitud"
-        except requests.exceptions.RequestException as e:
-            return None, f"Error de conexión: {str(e)}"
-    
-    return None, "Error después de múltiples intentos"
+    return consultar_api(url, params, ciudad)
 
 # ============================================
 # FUNCIÓN PARA OBTENER PRONÓSTICOS POR HORAS ESPECÍFICAS
 # ============================================
-def obtener_pronosticos_por_horas(forecast_data, horas=[6, 12, 18, 24, 36, 48]):
+HORAS_PRONOSTICO = (6, 12, 18, 24, 36, 48)
+
+def obtener_pronosticos_por_horas(forecast_data, horas=HORAS_PRONOSTICO):
     """Obtiene pronósticos para horas específicas (6, 12, 18, 24, 36, 48 horas)"""
+    return obtener_pronosticos_por_horas_lote([forecast_data], horas)[0]
+
+def obtener_pronosticos_por_horas_lote(forecast_data_list, horas=HORAS_PRONOSTICO):
+    """Obtiene los pronósticos por horas de varias ciudades en una sola pasada vectorizada"""
+    pronosticos = [{} for _ in forecast_data_list]
+    entradas = [(i, item) for i, forecast_data in enumerate(forecast_data_list)
+                if forecast_data and forecast_data.get('list') for item in forecast_data['list']]
+    if not entradas:
+        return pronosticos
     
-    if not forecast_data or 'list' not in forecast_data:
-        return {}
+    # Todos los períodos de todas las ciudades en un solo DataFrame, ordenado por la marca
+    # de tiempo UNIX 'dt' (UTC)
+    indices, items = zip(*entradas)
+    fdf = pd.json_normalize(list(items))
+    fdf = fdf.reindex(columns=fdf.columns.union(['pop', 'rain.3h', 'snow.3h'], sort=False))
+    fdf['ciudad'] = indices
+    fdf = fdf.sort_values('dt', kind='stable')
     
-    ahora = datetime.now()
-    pronosticos = {}
+    # Para cada ciudad y hora objetivo, el período más cercano con un único merge_asof
+    con_datos = fdf['ciudad'].unique()
+    objetivos = pd.DataFrame({
+        'ciudad': np.repeat(con_datos, len(horas)),
+        'clave': np.tile([f"{h}h" for h in horas], len(con_datos)),
+        'objetivo': int(time.time()) + np.tile(np.array(horas, dtype=np.int64) * 3600, len(con_datos))
+    }).sort_values('objetivo', kind='stable')
+    cercanos = pd.merge_asof(objetivos, fdf, left_on='objetivo', right_on='dt', by='ciudad', direction='nearest')
     
-    for horas_futuro in horas:
-        fecha_objetivo = ahora + timedelta(hours=horas_futuro)
-        # Buscar el pronóstico más cercano a la hora objetivo
-        pronostico_cercano = None
-        diferencia_minima = float('inf')
-        
-        for item in forecast_data['list']:
-            fecha_item = datetime.strptime(item['dt_txt'], '%Y-%m-%d %H:%M:%S')
-            diferencia = abs((fecha_item - fecha_objetivo).total_seconds())
-            
-            if diferencia < diferencia_minima:
-                diferencia_minima = diferencia
-                pronostico_cercano = item
-        
-        if pronostico_cercano:
-            pronosticos[f"{horas_futuro}h"] = {
-                'fecha': pronostico_cercano['dt_txt'],
-                'temperatura': pronostico_cercano['main']['temp'],
-                'descripcion': pronostico_cercano['weather'][0]['description'],
-                'icono': pronostico_cercano['weather'][0]['icon'],
-                'humedad': pronostico_cercano['main']['humidity'],
-                'viento': pronostico_cercano['wind']['speed'] * 3.6,
-                'probabilidad_lluvia': pronostico_cercano.get('pop', 0) * 100,
-                'lluvia_3h': pronostico_cercano.get('rain', {}).get('3h', 0),
-                'nieve_3h': pronostico_cercano.get('snow', {}).get('3h', 0),
-                'main': pronostico_cercano['weather'][0]['main'].lower(),
-                'description': pronostico_cercano['weather'][0]['description'].lower()
-            }
+    clima = cercanos['weather'].str[0]
+    campos = pd.DataFrame({
+        'fecha': cercanos['dt_txt'],
+        'temperatura': cercanos['main.temp'],
+        'descripcion': clima.str['description'],
+        'icono': clima.str['icon'],
+        'humedad': cercanos['main.humidity'],
+        'viento': cercanos['wind.speed'] * 3.6,
+        'probabilidad_lluvia': cercanos['pop'].fillna(0) * 100,
+        'lluvia_3h': cercanos['rain.3h'].fillna(0),
+        'nieve_3h': cercanos['snow.3h'].fillna(0),
+        'main': clima.str['main'].str.lower(),
+        'description': clima.str['description'].str.lower()
+    })
+    for ciudad, clave, registro in zip(cercanos['ciudad'], cercanos['clave'], campos.to_dict(orient='records')):
+        pronosticos[ciudad][clave] = registro
     
     return pronosticos
 
@@ -226,45 +311,394 @@ def analizar_eventos_meteorologicos(forecast_data):
         'horas_nieve': []
     }
     
-    if not forecast_data or 'list' not in forecast_data:
+    if not forecast_data or not forecast_data.get('list'):
         return eventos
     
-    for item in forecast_data['list']:
-        # Verificar condiciones meteorológicas
-        weather_main = item.get('weather', [{}])[0].get('main', '').lower()
-        weather_desc = item.get('weather', [{}])[0].get('description', '').lower()
+    # Cargar todos los períodos en un DataFrame y detectar eventos con máscaras vectorizadas
+    fdf = pd.json_normalize(forecast_data['list'])
+    fdf = fdf.reindex(columns=fdf.columns.union(['weather', 'dt_txt', 'pop', 'rain.3h'], sort=False))
+    clima = fdf['weather'].str[0]
+    weather_main = clima.str['main'].fillna('').str.lower()
+    weather_desc = clima.str['description'].fillna('').str.lower()
+    fechas = fdf['dt_txt'].fillna('')
+    probabilidad = fdf['pop'] * 100  # Probability of Precipitation (NaN si no viene)
+    
+    def maximo(valores):
+        return max(0, valores.max()) if valores.notna().any() else 0
+    
+    es_lluvia = weather_main.str.contains('rain|drizzle') | weather_desc.str.contains('lluvia')
+    es_tormenta = weather_main.str.contains('thunderstorm') | weather_desc.str.contains('tormenta')
+    es_granizo = weather_desc.str.contains('hail|granizo')  # Generalmente viene con tormenta
+    es_nieve = weather_main.str.contains('snow') | weather_desc.str.contains('nieve')
+    # La probabilidad de lluvia no considera la llovizna (drizzle)
+    es_lluvia_estricta = weather_main.str.contains('rain') | weather_desc.str.contains('lluvia')
+    
+    eventos['lluvia'] = bool(es_lluvia.any())
+    eventos['tormenta'] = bool(es_tormenta.any())
+    eventos['granizo'] = bool(es_granizo.any())
+    eventos['nieve'] = bool(es_nieve.any())
+    eventos['horas_lluvia'] = fechas[es_lluvia].tolist()
+    eventos['horas_tormenta'] = fechas[es_tormenta].tolist()
+    eventos['horas_nieve'] = fechas[es_nieve].tolist()
+    eventos['intensidad_lluvia_max'] = maximo(fdf.loc[es_lluvia, 'rain.3h'])
+    eventos['probabilidad_lluvia_max'] = maximo(probabilidad[es_lluvia_estricta])
+    eventos['probabilidad_nieve_max'] = maximo(probabilidad[es_nieve])
+    
+    return eventos
+
+# ============================================
+# FUNCIÓN PARA CONSTRUIR EL DATAFRAME
+# ============================================
+@st.cache_data(max_entries=len(PAISES_CONFIG), show_spinner=False)
+def construir_dataframe(clave, _weather_data, _forecast_data_list):
+    """Construye el DataFrame de todas las ciudades y los eventos pronosticados de cada una"""
+    # Las respuestas completas (40 períodos de pronóstico por ciudad) no se hashean en cada
+    # rerun: la caché se indexa solo por la clave liviana que arma quien llama
+    # (se conservan tantas entradas como países: las más antiguas se descartan)
+    
+    # Analizar pronóstico de cada ciudad (sin pronóstico se obtienen los eventos por defecto)
+    eventos_por_ciudad = [analizar_eventos_meteorologicos(forecast) for forecast in _forecast_data_list]
+    
+    # Aplanar las respuestas JSON en columnas ('main.temp', 'wind.speed', ...)
+    planos = pd.json_normalize(_weather_data)
+    planos = planos.reindex(columns=planos.columns.union(['main.feels_like', 'wind.deg', 'visibility'], sort=False))
+    clima = planos['weather'].str[0]
+    visibilidad = planos['visibility'].to_numpy(dtype=float) / 1000
+    
+    df = pd.DataFrame({
+        'Ciudad': planos['name'],
+        'Latitud': planos['coord.lat'],
+        'Longitud': planos['coord.lon'],
+        'Descripción del clima': clima.str['description'],
+        'Temperatura (°C)': planos['main.temp'],
+        'Sensación térmica (°C)': planos['main.feels_like'].fillna('N/A'),
+        'Temperatura mínima (°C)': planos['main.temp_min'],
+        'Temperatura máxima (°C)': planos['main.temp_max'],
+        'Humedad (%)': planos['main.humidity'],
+        'Presión (hPa)': planos['main.pressure'],
+        'Viento (km/h)': planos['wind.speed'].to_numpy() * 3.6,
+        'Dirección del viento (°)': planos['wind.deg'].fillna('N/A'),
+        'Visibilidad (km)': pd.Series(visibilidad).where(visibilidad > 0, 'N/A'),
+        'Ícono del clima': clima.str['icon'],
+        'País': planos['sys.country']
+    })
+    
+    eventos_df = pd.DataFrame(eventos_por_ciudad)
+    for columna, evento in [('Pronóstico Lluvia', 'lluvia'), ('Pronóstico Tormenta', 'tormenta'),
+                            ('Pronóstico Granizo', 'granizo'), ('Pronóstico Nieve', 'nieve')]:
+        df[columna] = np.where(eventos_df[evento], 'Sí', 'No')
+    prob_lluvia = eventos_df['probabilidad_lluvia_max'].to_numpy(dtype=float)
+    prob_nieve = eventos_df['probabilidad_nieve_max'].to_numpy(dtype=float)
+    intensidad = eventos_df['intensidad_lluvia_max'].to_numpy(dtype=float)
+    df['Prob. Lluvia (%)'] = np.where(prob_lluvia > 0, np.char.mod('%.0f%%', prob_lluvia), 'N/A')
+    df['Prob. Nieve (%)'] = np.where(prob_nieve > 0, np.char.mod('%.0f%%', prob_nieve), 'N/A')
+    df['Intensidad Lluvia (mm)'] = np.where(intensidad > 0, np.char.mod('%.2f', intensidad), 'N/A')
+    
+    # Ciudades con algún evento pronosticado (para la sección de alertas)
+    hay_eventos = eventos_df[['lluvia', 'tormenta', 'granizo', 'nieve']].any(axis=1).to_numpy()
+    
+    return df, eventos_por_ciudad, hay_eventos
+
+# ============================================
+# FUNCIÓN PARA MOSTRAR ALERTAS DE PRONÓSTICO
+# ============================================
+def mostrar_alertas(eventos, con_horarios=True):
+    """Muestra en dos columnas las alertas de los eventos pronosticados de una ciudad"""
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        if eventos['lluvia']:
+            st.warning(f"🌧️ **Lluvia pronosticada**")
+            if eventos['probabilidad_lluvia_max'] > 0:
+                st.write(f"   Probabilidad máxima: {eventos['probabilidad_lluvia_max']:.0f}%")
+            if eventos['intensidad_lluvia_max'] > 0:
+                st.write(f"   Intensidad máxima: {eventos['intensidad_lluvia_max']:.2f} mm")
+            if con_horarios and eventos['horas_lluvia']:
+                st.write(f"   Horarios: {', '.join(eventos['horas_lluvia'][:3])}...")
         
-        # Detectar lluvia
-        if 'rain' in weather_main or 'lluvia' in weather_desc or 'drizzle' in weather_main:
-            eventos['lluvia'] = True
-            eventos['horas_lluvia'].append(item.get('dt_txt', ''))
-            # Obtener intensidad de lluvia si está disponible
-            if 'rain' in item and '3h' in item['rain']:
-                eventos['intensidad_lluvia_max'] = max(eventos['intensidad_lluvia_max'], item['rain']['3h'])
+        if eventos['tormenta']:
+            st.error(f"⛈️ **Tormenta pronosticada**")
+            if con_horarios and eventos['horas_tormenta']:
+                st.write(f"   Horarios: {', '.join(eventos['horas_tormenta'][:3])}...")
+    
+    with col2:
+        if eventos['granizo']:
+            st.error(f"🧊 **Granizo pronosticado**")
+            st.write("   ⚠️ Precaución: riesgo de granizo")
         
-        # Detectar tormenta
-        if 'thunderstorm' in weather_main or 'tormenta' in weather_desc:
-            eventos['tormenta'] = True
-            eventos['horas_tormenta'].append(item.get('dt_txt', ''))
+        if eventos['nieve']:
+            st.info(f"❄️ **Nieve pronosticada**")
+            if eventos['probabilidad_nieve_max'] > 0:
+                st.write(f"   Probabilidad máxima: {eventos['probabilidad_nieve_max']:.0f}%")
+            if con_horarios and eventos['horas_nieve']:
+                st.write(f"   Horarios: {', '.join(eventos['horas_nieve'][:3])}...")
+
+# ============================================
+# FUNCIÓN PARA ARMAR LAS TARJETAS DE PRONÓSTICO POR HORAS
+# ============================================
+def tarjetas_pronostico_html(pronosticos, horas=tuple(f"{h}h" for h in HORAS_PRONOSTICO)):
+    """Arma en un único bloque HTML (una fila flex) las tarjetas de pronóstico por horas de una ciudad"""
+    tarjetas = []
+    for hora in horas:
+        if hora not in pronosticos:
+            tarjetas.append('<div style="flex: 1; min-width: 0; padding: 10px; text-align: center;">N/D</div>')
+            continue
+        p = pronosticos[hora]
         
-        # Detectar granizo (generalmente viene con tormenta)
-        if 'hail' in weather_desc or 'granizo' in weather_desc:
-            eventos['granizo'] = True
+        # Determinar emoji según condiciones
+        emoji = "☀️"
+        color_bg = "#E8F5E9"  # Verde claro
         
-        # Detectar nieve
-        if 'snow' in weather_main or 'nieve' in weather_desc:
-            eventos['nieve'] = True
-            eventos['horas_nieve'].append(item.get('dt_txt', ''))
+        if 'thunderstorm' in p['main'] or 'tormenta' in p['description']:
+            emoji = "⛈️"
+            color_bg = "#FFEBEE"  # Rojo claro
+        elif 'rain' in p['main'] or 'lluvia' in p['description'] or p['lluvia_3h'] > 0:
+            emoji = "🌧️"
+            color_bg = "#E3F2FD"  # Azul claro
+        elif 'snow' in p['main'] or 'nieve' in p['description'] or p['nieve_3h'] > 0:
+            emoji = "❄️"
+            color_bg = "#E1F5FE"  # Azul muy claro
+        elif 'hail' in p['description'] or 'granizo' in p['description']:
+            emoji = "🧊"
+            color_bg = "#FFF3E0"  # Naranja claro
+        elif 'cloud' in p['main']:
+            emoji = "☁️"
+            color_bg = "#F5F5F5"  # Gris claro
         
-        # Probabilidades de precipitación
-        if 'pop' in item:  # Probability of Precipitation
-            pop = item['pop'] * 100
-            if 'rain' in weather_main or 'lluvia' in weather_desc:
-                eventos['probabilidad_lluvia_max'] = max(eventos['probabilidad_lluvia_max'], pop)
-            if 'snow' in weather_main or 'nieve' in weather_desc:
-                eventos['probabilidad_nieve_max'] = max(eventos['probabilidad_nieve_max'], pop)
+        lluvia_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #1976d2;'>🌧️ {p['probabilidad_lluvia']:.0f}%</p>" if p['probabilidad_lluvia'] > 0 else ""
+        lluvia_mm_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #1976d2;'>💧 {p['lluvia_3h']:.1f}mm</p>" if p['lluvia_3h'] > 0 else ""
+        nieve_mm_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #64B5F6;'>❄️ {p['nieve_3h']:.1f}mm</p>" if p['nieve_3h'] > 0 else ""
+        
+        fecha_formateada = p['fecha'][:16] if 'fecha' in p else "N/D"
+        # Sin saltos de línea: una línea vacía cortaría el bloque HTML dentro del markdown
+        tarjetas.append(
+            f'<div style="flex: 1; min-width: 0; background-color: {color_bg}; padding: 10px; border-radius: 8px; text-align: center;">'
+            f'<h4 style="margin: 5px 0;">{hora}</h4>'
+            f'<p style="font-size: 24px; margin: 5px 0;">{emoji}</p>'
+            f'<p style="margin: 3px 0; font-weight: bold;">{p["temperatura"]:.1f}°C</p>'
+            f'<p style="margin: 3px 0; font-size: 0.85em;">{p["descripcion"].title()}</p>'
+            f'<p style="margin: 3px 0; font-size: 0.8em;">💧 {p["humedad"]}%</p>'
+            f'<p style="margin: 3px 0; font-size: 0.8em;">💨 {p["viento"]:.1f} km/h</p>'
+            f'{lluvia_html}{lluvia_mm_html}{nieve_mm_html}'
+            f'<p style="margin: 5px 0; font-size: 0.75em; color: #666;">{fecha_formateada} UTC</p>'
+            '</div>'
+        )
     
-    return eventos
+    return '<div style="display: flex; gap: 8px;">' + ''.join(tarjetas) + '</div>'
+
+# ============================================
+# FUNCIÓN PARA CONSTRUIR EL MAPA INTERACTIVO
+# ============================================
+# Función JS que crea cada marcador en el navegador a partir de una fila
+# [lat, lon, popup, tooltip, color, icono]; así el HTML lleva un único arreglo de datos
+# en lugar de un objeto JS por ciudad
+CALLBACK_MARCADOR = """
+function (row) {
+    var icono = L.AwesomeMarkers.icon({
+        icon: row[5], prefix: 'fa', markerColor: row[4], iconColor: 'white', extraClasses: 'fa-rotate-0'
+    });
+    var marcador = L.marker(new L.LatLng(row[0], row[1]), {icon: icono});
+    marcador.bindPopup(row[2], {maxWidth: 300});
+    marcador.bindTooltip('<div>' + row[3] + '</div>', {sticky: true});
+    return marcador;
+}
+"""
+
+# Una entrada por país basta: los datos cambian con cada ventana y las entradas anteriores se descartan
+@st.cache_data(max_entries=len(PAISES_CONFIG), show_spinner=False)
+def construir_mapa_html(df, eventos_por_ciudad):
+    """Construye el mapa Folium y devuelve su HTML (cacheado mientras los datos no cambien)"""
+    lat_centro = df['Latitud'].mean()
+    lon_centro = df['Longitud'].mean()
+    
+    m = folium.Map(
+        location=[lat_centro, lon_centro],
+        zoom_start=6,
+        tiles='OpenStreetMap'
+    )
+    
+    # Capa de calor
+    heat_data = df[['Latitud', 'Longitud', 'Temperatura (°C)']].to_numpy()
+    HeatMap(heat_data, radius=25, blur=15, max_zoom=1).add_to(m)
+    
+    # Color según temperatura (<10 azul, <20 verde, <30 naranja, resto rojo)
+    temps = df['Temperatura (°C)'].to_numpy()
+    colores = np.select([temps < 10, temps < 20, temps < 30], ['blue', 'green', 'orange'], default='red')
+    # Icono y color según eventos meteorológicos (el granizo tiene prioridad, luego tormenta,
+    # nieve y lluvia); sin eventos se mantiene el color por temperatura
+    eventos_df = pd.DataFrame(eventos_por_ciudad)
+    granizo, tormenta = eventos_df['granizo'].to_numpy(), eventos_df['tormenta'].to_numpy()
+    nieve, lluvia = eventos_df['nieve'].to_numpy(), eventos_df['lluvia'].to_numpy()
+    mascaras = [granizo, tormenta, nieve, lluvia]
+    iconos = np.select(mascaras, ['exclamation-triangle', 'bolt', 'snowflake', 'tint'], default='cloud')
+    colores = np.select(mascaras, ['red', 'purple', 'lightblue', 'blue'], default=colores)
+    
+    # Texto y color del pronóstico para el popup
+    partes = [
+        np.where(lluvia, np.char.mod('🌧️ Lluvia (%.0f%%)', eventos_df['probabilidad_lluvia_max'].to_numpy(dtype=float)), ''),
+        np.where(tormenta, '⛈️ Tormenta', ''),
+        np.where(granizo, '🧊 Granizo', ''),
+        np.where(nieve, np.char.mod('❄️ Nieve (%.0f%%)', eventos_df['probabilidad_nieve_max'].to_numpy(dtype=float)), '')
+    ]
+    textos_pronostico = ['<br>'.join(filter(None, fila)) or 'Sin eventos pronosticados' for fila in zip(*partes)]
+    colores_pronostico = np.where(tormenta | granizo, '#d32f2f', '#1976d2')
+    
+    # Popups armados por columnas con concatenación vectorizada de cadenas
+    textos_pronostico = pd.Series(textos_pronostico, index=df.index)
+    colores_pronostico = pd.Series(colores_pronostico, index=df.index)
+    popups = (
+        '<div style="font-family: Arial; width: 280px;">'
+        '<h3 style="margin: 5px 0; color: #2c3e50;">' + df['Ciudad'] + '</h3>'
+        '<hr style="margin: 5px 0;">'
+        '<p style="margin: 3px 0;"><b>🌡️ Temperatura:</b> ' + df['Temperatura (°C)'].map('{:.1f}'.format) + '°C</p>'
+        '<p style="margin: 3px 0;"><b>🌤️ Estado:</b> ' + df['Descripción del clima'] + '</p>'
+        '<p style="margin: 3px 0;"><b>💧 Humedad:</b> ' + df['Humedad (%)'].astype(str) + '%</p>'
+        '<p style="margin: 3px 0;"><b>💨 Viento:</b> ' + df['Viento (km/h)'].map('{:.1f}'.format) + ' km/h</p>'
+        '<p style="margin: 3px 0;"><b>📊 Presión:</b> ' + df['Presión (hPa)'].astype(str) + ' hPa</p>'
+        '<hr style="margin: 8px 0;">'
+        '<p style="margin: 3px 0;"><b>📅 Pronóstico (5 días):</b></p>'
+        '<p style="margin: 3px 0; color: ' + colores_pronostico + ';">' + textos_pronostico + '</p>'
+        '</div>'
+    )
+    
+    # Tooltip con información de pronóstico
+    hay_eventos = lluvia | tormenta | granizo | nieve
+    tooltips = df['Ciudad'] + ': ' + df['Temperatura (°C)'].map('{:.1f}'.format) + '°C' + np.where(hay_eventos, ' ⚠️', '')
+    
+    # Marcadores agrupados, creados en el navegador desde un único arreglo de datos
+    datos_marcadores = [
+        [float(lat), float(lon), popup_html, tooltip_text, color, icon]
+        for lat, lon, popup_html, tooltip_text, color, icon in zip(
+            df['Latitud'].to_numpy(), df['Longitud'].to_numpy(), popups.to_numpy(),
+            tooltips.to_numpy(), colores, iconos
+        )
+    ]
+    FastMarkerCluster(datos_marcadores, callback=CALLBACK_MARCADOR).add_to(m)
+    
+    # Renderizar el HTML en memoria (sin escribir ni leer un archivo temporal)
+    return m.get_root().render()
+
+# ============================================
+# FUNCIONES PARA EL MAPA DE ISOTERMAS
+# ============================================
+# Cada caché guarda aproximadamente una entrada por país: las de países anteriores se descartan
+@st.cache_data(max_entries=len(PAISES_CONFIG), show_spinner=False)
+def operador_isotermas(posiciones, limites, resolucion=50):
+    """Matriz que lleva las temperaturas de las ciudades a la cuadrícula interpolada (solo depende de las posiciones)"""
+    # Importación diferida: scipy solo se carga si se llega a dibujar el mapa de isotermas
+    from scipy.interpolate import RBFInterpolator
+    
+    lat_min, lat_max, lon_min, lon_max = limites
+    grid_x, grid_y = np.meshgrid(np.linspace(lat_min, lat_max, resolucion),
+                                 np.linspace(lon_min, lon_max, resolucion), indexing='ij')
+    puntos = np.column_stack([grid_x.ravel(), grid_y.ravel()])
+    
+    # El interpolador RBF es lineal en los valores: interpolar la matriz identidad da la
+    # contribución de cada ciudad a cada punto de la cuadrícula. Un suavizado mínimo evita
+    # un sistema singular si dos ciudades comparten coordenadas
+    rbf = RBFInterpolator(posiciones, np.eye(len(posiciones)),
+                          neighbors=min(12, len(posiciones)), kernel='thin_plate_spline', smoothing=1e-6)
+    # float32 alcanza para temperaturas en °C y reduce a la mitad el operador cacheado y la cuadrícula
+    return rbf(puntos).astype(np.float32)
+
+@st.cache_data(max_entries=len(PAISES_CONFIG), show_spinner=False)
+def calcular_isotermas(posiciones, temperaturas, limites, resolucion=50):
+    """Interpola las temperaturas sobre una cuadrícula regular (cacheado por coordenadas y temperaturas)"""
+    # Spline de placa delgada con los 12 vecinos más cercanos: suave y cubre toda la cuadrícula.
+    # El operador solo depende de las posiciones (fijas por país): al cambiar las temperaturas
+    # la interpolación es un producto matriz-vector
+    operador = operador_isotermas(posiciones, limites, resolucion)
+    return (operador @ temperaturas.astype(np.float32)).reshape(resolucion, resolucion)
+
+@st.cache_data(max_entries=len(PAISES_CONFIG), show_spinner=False)
+def renderizar_isotermas_png(df, pais):
+    """Dibuja el mapa de isotermas y lo devuelve como PNG (cacheado mientras los datos no cambien)"""
+    # Importación diferida: matplotlib no se carga en el arranque si el mapa no llega a dibujarse
+    from matplotlib.figure import Figure
+    from matplotlib.transforms import offset_copy
+    from matplotlib.font_manager import FontProperties
+    
+    # Columnas extraídas una sola vez y reutilizadas en la interpolación, los puntos y las etiquetas
+    lats = df['Latitud'].to_numpy()
+    lons = df['Longitud'].to_numpy()
+    temperaturas = df['Temperatura (°C)'].to_numpy()
+    posiciones = np.column_stack((lats, lons))
+    
+    # Crear cuadrícula para interpolación
+    lat_min, lat_max = lats.min(), lats.max()
+    lon_min, lon_max = lons.min(), lons.max()
+    
+    # Expandir un poco el área para mejor visualización
+    lat_range = lat_max - lat_min
+    lon_range = lon_max - lon_min
+    lat_min -= lat_range * 0.1
+    lat_max += lat_range * 0.1
+    lon_min -= lon_range * 0.1
+    lon_max += lon_range * 0.1
+    
+    # Resolución de la cuadrícula acorde a la densidad de ciudades (entre 40 y 100 puntos por eje)
+    resolucion = min(100, max(40, int(8 * np.sqrt(len(df)))))
+    # La cuadrícula queda determinada por los límites: se dibuja con extent, sin grid_x/grid_y
+    grid_z = calcular_isotermas(posiciones, temperaturas, (lat_min, lat_max, lon_min, lon_max), resolucion)
+    
+    # Figure directa (sin pyplot): no se registra en el gestor global de figuras, que no es
+    # seguro entre hilos de sesiones concurrentes, y no hace falta cerrarla
+    fig = Figure(figsize=(12, 8))
+    ax = fig.subplots()
+    # La cuadrícula es regular: se dibuja como imagen rasterizada en lugar de triangular contornos.
+    # Las filas de grid_z recorren latitudes y las columnas longitudes (longitud en el eje X)
+    # Los valores están en los nodos de la cuadrícula: cada píxel se centra en su nodo
+    medio_lat = (lat_max - lat_min) / (resolucion - 1) / 2
+    medio_lon = (lon_max - lon_min) / (resolucion - 1) / 2
+    # Escala de colores entre los percentiles 2 y 98 de las ciudades: una estación atípica no
+    # comprime el resto de la escala (los extremos se indican con las puntas de la barra)
+    temp_min, temp_max = np.percentile(temperaturas, [2, 98])
+    im = ax.imshow(grid_z, extent=(lon_min - medio_lon, lon_max + medio_lon, lat_min - medio_lat, lat_max + medio_lat),
+                   origin='lower', aspect='auto', cmap='RdYlBu_r', interpolation='bilinear',
+                   vmin=temp_min, vmax=temp_max)
+    fig.colorbar(im, ax=ax, label='Temperatura (°C)', extend='both')
+    
+    # Agregar puntos de las ciudades (con la misma escala de colores que la cuadrícula)
+    ax.scatter(lons, lats,
+               c=temperaturas,
+               s=100, edgecolors='black',
+               linewidth=2, cmap='RdYlBu_r', vmin=temp_min, vmax=temp_max, zorder=5)
+    
+    # Agregar etiquetas de ciudades: todas comparten el mismo desplazamiento de 5 puntos,
+    # así que se construye una sola transformación en lugar de una por anotación
+    # Lo mismo con la fuente: una sola FontProperties compartida por todas las etiquetas
+    desplazamiento = offset_copy(ax.transData, fig=fig, x=5, y=5, units='points')
+    fuente_etiquetas = FontProperties(size=8, weight='bold')
+    for nombre, lon, lat in zip(df['Ciudad'].to_numpy(), lons, lats):
+        ax.text(lon, lat, nombre, transform=desplazamiento, fontproperties=fuente_etiquetas)
+    
+    ax.set_xlabel('Longitud', fontsize=12)
+    ax.set_ylabel('Latitud', fontsize=12)
+    # Sin hora en el título: el PNG cacheado puede ser de otro rerun; la hora de actualización
+    # se muestra en el pie de página
+    ax.set_title(f'Mapa de Isotermas - {pais}',
+                 fontsize=14, fontweight='bold')
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
+    return buffer.getvalue()
+
+# ============================================
+# VIGENCIA DE LA CACHÉ
+# ============================================
+# Al comenzar una nueva ventana se descartan las respuestas vencidas (también las del disco)
+ventana = ventana_cache()
+ventana_pronostico = ventana_cache(DURACION_PRONOSTICO)
+activa = ventana_activa()
+if activa['ventana'] not in (None, ventana):
+    obtener_clima.clear()
+    _fetch_clima_raw.cache_clear()
+    obtener_clima_grupo.clear()
+if activa['ventana_pronostico'] not in (None, ventana_pronostico):
+    obtener_pronostico.clear()
+activa.update(ventana=ventana, ventana_pronostico=ventana_pronostico)
 
 # ============================================
 # BÚSQUEDA DE CIUDAD ESPECÍFICA
@@ -287,17 +721,20 @@ ciudad_personalizada_pronosticos = {}
 if buscar_ciudad and ciudad_personalizada:
     with st.sidebar:
         with st.spinner(f"Buscando {ciudad_personalizada}..."):
-            # Obtener datos actuales
-            data, error = obtener_clima(ciudad_personalizada, API_KEY)
+            # Consultar clima actual y pronóstico en paralelo
+            with ThreadPoolExecutor(max_workers=2) as ex:
+                futuro_clima = ex.submit(consultar, obtener_clima, ciudad_personalizada, API_KEY, ventana)
+                futuro_pronostico = ex.submit(consultar, obtener_pronostico, ciudad_personalizada, API_KEY,
+                                              ventana_pronostico)
+                data, error = futuro_clima.result()
+                forecast, forecast_error = futuro_pronostico.result()
             if data:
                 ciudad_personalizada_data = data
                 st.success(f"✅ {data['name']} encontrada")
                 
-                # Obtener pronóstico
-                forecast, forecast_error = obtener_pronostico(ciudad_personalizada, API_KEY)
                 if forecast:
                     ciudad_personalizada_forecast = forecast
-                    ciudad_personalizada_pronosticos = obtener_pronosticos_por_horas(forecast, horas=[6, 12, 18, 24, 36, 48])
+                    ciudad_personalizada_pronosticos = obtener_pronosticos_por_horas(forecast, horas=HORAS_PRONOSTICO)
                 else:
                     if forecast_error:
                         st.warning(f"⚠️ Pronóstico no disponible: {forecast_error}")
@@ -311,285 +748,166 @@ if buscar_ciudad and ciudad_personalizada:
 st.sidebar.markdown("---")
 obtener_datos = st.sidebar.button("🔍 Obtener Datos Meteorológicos", type="primary", use_container_width=True)
 
-# Limpiar datos si se cambió el país
-if 'pais_anterior' in st.session_state and st.session_state.pais_anterior != pais_seleccionado:
-    if 'weather_data' in st.session_state:
-        del st.session_state.weather_data
-    if 'errores' in st.session_state:
-        del st.session_state.errores
+# Forzar una nueva consulta del país seleccionado. Las cachés son compartidas por todas las
+# sesiones (y persistidas en disco): solo se descartan las respuestas de estas ciudades
+if obtener_datos:
+    refrescos()[pais_seleccionado] = refrescos().get(pais_seleccionado, 0) + 1
+    for ciudad in ciudades:
+        obtener_clima.clear(ciudad, API_KEY, ventana)
+        obtener_pronostico.clear(ciudad, API_KEY, ventana_pronostico)
+    ids_conocidos = ids_ciudades()
+    individuales = consultas_individuales()
+    # Se descartan tanto los lotes de esta ventana como los de todo el país, que es el que
+    # se consultará a continuación
+    ids_pais = [ids_conocidos[ciudad] for ciudad in ciudades if ciudad in ids_conocidos]
+    ids_agrupados = [ids_conocidos[ciudad] for ciudad in ciudades
+                     if ciudad in ids_conocidos and individuales.get(ciudad) != ventana]
+    for ids in (ids_pais, ids_agrupados):
+        for inicio in range(0, len(ids), 20):
+            obtener_clima_grupo.clear(tuple(ids[inicio:inicio + 20]), API_KEY, ventana)
+    for ciudad in ciudades:
+        individuales.pop(ciudad, None)
+    # lru_cache no permite borrar una sola entrada; la capa está por debajo de obtener_clima,
+    # así que vaciarla no descarta las respuestas de otras sesiones
+    _fetch_clima_raw.cache_clear()
 
-st.session_state.pais_anterior = pais_seleccionado
+# Las respuestas de la API se cachean durante su ventana vigente (10 minutos el clima actual,
+# 3 horas el pronóstico), por lo que en cada rerun solo se consultan las que no estén en caché
+with st.spinner(f"🌍 Obteniendo datos meteorológicos y pronósticos de {pais_seleccionado}..."):
+    weather_data = []
+    forecast_data_list = []
+    errores = []
+    progress_bar = st.progress(0)
+    status_text = st.empty()
 
-if obtener_datos or 'weather_data' not in st.session_state:
-    
-    with st.spinner(f"🌍 Obteniendo datos meteorológicos y pronósticos de {pais_seleccionado}..."):
-        weather_data = []
-        forecast_data_list = []
-        errores = []
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
+    # Las consultas son de E/S: se envían en lote las consultas (actual y pronóstico)
+    # de todas las ciudades y se conserva el orden de las ciudades
+    resultados = {'clima': [None] * len(ciudades), 'pronostico': [None] * len(ciudades)}
+    ids_conocidos = ids_ciudades()
+    individuales = consultas_individuales()
+    # Solo se agrupan las ciudades cuyo clima no está ya en caché en esta ventana: las demás
+    # se leen de obtener_clima sin ninguna consulta nueva
+    con_id = [i for i, ciudad in enumerate(ciudades)
+              if ciudad in ids_conocidos and individuales.get(ciudad) != ventana]
+    desde_grupo = set()
+    with ThreadPoolExecutor(max_workers=min(16, 2 * len(ciudades))) as ex:
+        futuros = {}
+        # Las ciudades con id conocido piden el clima actual agrupadas (hasta 20 por consulta)
+        for inicio in range(0, len(con_id), 20):
+            lote = tuple(con_id[inicio:inicio + 20])
+            ids = tuple(ids_conocidos[ciudades[i]] for i in lote)
+            futuros[ex.submit(consultar, obtener_clima_grupo, ids, API_KEY, ventana)] = ('grupo', lote)
+        agrupadas = set(con_id)
         for i, ciudad in enumerate(ciudades):
-            status_text.text(f"Consultando: {ciudad}...")
-            
-            # Obtener datos actuales
-            data, error = obtener_clima(ciudad, API_KEY)
-            if data:
-                weather_data.append(data)
-                
-                # Obtener pronóstico
-                forecast, forecast_error = obtener_pronostico(ciudad, API_KEY)
-                if forecast:
-                    forecast_data_list.append(forecast)
-                else:
-                    forecast_data_list.append(None)
-                    # Guardar el error si es relevante para mostrar después
-                    if forecast_error and forecast_error not in ["Ciudad no encontrada", "API Key inválida"]:
-                        # Solo mostrar advertencia si es un problema de pronóstico específico
-                        pass
+            if i not in agrupadas:
+                futuros[ex.submit(consultar, obtener_clima, ciudad, API_KEY, ventana)] = ('clima', i)
+            futuros[ex.submit(consultar, obtener_pronostico, ciudad, API_KEY, ventana_pronostico)] = ('pronostico', i)
+        pronostico_bloqueado = False
+        for completados, futuro in enumerate(as_completed(futuros), start=1):
+            tipo, clave = futuros[futuro]
+            if tipo == 'grupo':
+                data_grupo, error_grupo = futuro.result()
+                por_id = {item['id']: item for item in (data_grupo or {}).get('list', [])}
+                for i in clave:
+                    if error_grupo == ERROR_LIMITE:
+                        # Ante un 429 se informa el error: repetir la consulta ciudad por ciudad
+                        # multiplicaría las consultas bajo el mismo límite. Cualquier otro error
+                        # deja la ciudad pendiente y se consulta individualmente
+                        resultados['clima'][i] = (None, error_grupo)
+                    elif ids_conocidos[ciudades[i]] in por_id:
+                        resultados['clima'][i] = (por_id[ids_conocidos[ciudades[i]]], None)
+                        desde_grupo.add(i)
+                status_text.text(f"Consultadas: {len(clave)} ciudades")
+            elif futuro.cancelled():
+                resultados[tipo][clave] = (None, ERROR_LIMITE)
             else:
-                errores.append((ciudad, error))
-                forecast_data_list.append(None)
-            
-            progress_bar.progress((i + 1) / len(ciudades))
-        
-        progress_bar.empty()
-        status_text.empty()
-        
-        if errores:
-            st.warning(f"⚠️ {len(errores)} ciudades no pudieron ser procesadas")
-            for ciudad, error in errores:
-                st.error(f"❌ {ciudad}: {error}")
+                resultados[tipo][clave] = futuro.result()
+                status_text.text(f"Consultado: {ciudades[clave]}")
+                # Tras el primer 429 del pronóstico no se envían las consultas de pronóstico
+                # que aún esperan en cola (los errores nunca quedan en caché: se reintentan
+                # en el próximo rerun)
+                if tipo == 'pronostico' and resultados[tipo][clave][1] == ERROR_LIMITE and not pronostico_bloqueado:
+                    pronostico_bloqueado = True
+                    for pendiente, (tipo_pendiente, _) in futuros.items():
+                        if tipo_pendiente == 'pronostico':
+                            pendiente.cancel()
+            progress_bar.progress(completados / len(futuros))
         
-        if weather_data:
-            st.session_state.weather_data = weather_data
-            st.session_state.forecast_data = forecast_data_list
-            st.session_state.errores = errores
-            
-            # Verificar cuántos pronósticos se obtuvieron
-            pronosticos_obtenidos = sum(1 for f in forecast_data_list if f is not None)
-            ciudades_sin_pronostico = len(weather_data) - pronosticos_obtenidos
-            
-            if pronosticos_obtenidos > 0:
-                st.success(f"✅ {len(weather_data)} ciudades procesadas correctamente")
-                if ciudades_sin_pronostico > 0:
-                    st.warning(f"⚠️ {ciudades_sin_pronostico} ciudades sin pronóstico disponible. Se mostrarán solo datos actuales.")
-                    st.info("💡 **Nota sobre pronósticos:**\n"
-                           "- Las API keys gratuitas pueden tener límites en el acceso a pronósticos\n"
-                           "- Si excedes el límite (429), espera unos minutos\n"
-                           "- Algunas ciudades remotas pueden no tener datos de pronóstico\n"
-                           "- Los datos actuales siempre estarán disponibles")
-            else:
-                st.success(f"✅ {len(weather_data)} ciudades procesadas correctamente")
-                st.warning("⚠️ **Pronósticos no disponibles**")
-                st.info("💡 **Posibles razones:**\n"
-                       "- API Key gratuita con límites alcanzados\n"
-                       "- Límite de solicitudes excedido (espera unos minutos)\n"
-                       "- La API key puede no tener acceso al endpoint de pronóstico\n"
-                       "- Problemas temporales de conexión\n\n"
-                       "**Los datos actuales están disponibles, pero los pronósticos no se pueden mostrar.**")
+        # Las ciudades que faltan en la respuesta agrupada (o cuyo lote falló) se consultan individualmente
+        pendientes = [i for i, resultado in enumerate(resultados['clima']) if resultado is None]
+        for i, resultado in zip(pendientes, ex.map(lambda i: consultar(obtener_clima, ciudades[i], API_KEY, ventana), pendientes)):
+            resultados['clima'][i] = resultado
+
+    for i, (ciudad, (data, error), (forecast, _)) in enumerate(zip(ciudades, resultados['clima'], resultados['pronostico'])):
+        if data:
+            ids_conocidos[ciudad] = data['id']
+            if i not in desde_grupo:
+                individuales[ciudad] = ventana
+            weather_data.append(data)
+            forecast_data_list.append(forecast)
         else:
-            st.error("❌ No se pudieron obtener datos de ninguna ciudad")
-            st.stop()
+            errores.append((ciudad, error))
 
-# Verificar si hay datos en session_state
-if 'weather_data' not in st.session_state or not st.session_state.weather_data:
-    st.info("👈 Usa el botón en el sidebar para obtener los datos meteorológicos")
-    st.stop()
+    progress_bar.empty()
+    status_text.empty()
 
-weather_data = st.session_state.weather_data
-forecast_data_list = st.session_state.get('forecast_data', [])
+    if errores:
+        st.warning(f"⚠️ {len(errores)} ciudades no pudieron ser procesadas")
+        for ciudad, error in errores:
+            st.error(f"❌ {ciudad}: {error}")
 
-# Obtener pronósticos por horas específicas para cada ciudad
-pronosticos_por_horas = []
-for i, forecast_data in enumerate(forecast_data_list):
-    if forecast_data:
-        pronosticos = obtener_pronosticos_por_horas(forecast_data, horas=[6, 12, 18, 24, 36, 48])
-        pronosticos_por_horas.append(pronosticos)
+    if weather_data:
+        # Verificar cuántos pronósticos se obtuvieron
+        pronosticos_obtenidos = sum(1 for f in forecast_data_list if f is not None)
+        ciudades_sin_pronostico = len(weather_data) - pronosticos_obtenidos
+
+        if pronosticos_obtenidos > 0:
+            st.success(f"✅ {len(weather_data)} ciudades procesadas correctamente")
+            if ciudades_sin_pronostico > 0:
+                st.warning(f"⚠️ {ciudades_sin_pronostico} ciudades sin pronóstico disponible. Se mostrarán solo datos actuales.")
+                st.info("💡 **Nota sobre pronósticos:**\n"
+                       "- Las API keys gratuitas pueden tener límites en el acceso a pronósticos\n"
+                       "- Si excedes el límite (429), espera unos minutos\n"
+                       "- Algunas ciudades remotas pueden no tener datos de pronóstico\n"
+                       "- Los datos actuales siempre estarán disponibles")
+        else:
+            st.success(f"✅ {len(weather_data)} ciudades procesadas correctamente")
+            st.warning("⚠️ **Pronósticos no disponibles**")
+            st.info("💡 **Posibles razones:**\n"
+                   "- API Key gratuita con límites alcanzados\n"
+                   "- Límite de solicitudes excedido (espera unos minutos)\n"
+                   "- La API key puede no tener acceso al endpoint de pronóstico\n"
+                   "- Problemas temporales de conexión\n\n"
+                   "**Los datos actuales están disponibles, pero los pronósticos no se pueden mostrar.**")
     else:
-        pronosticos_por_horas.append({})
+        st.error("❌ No se pudieron obtener datos de ninguna ciudad")
+        st.stop()
+
+# Obtener pronósticos por horas específicas para cada ciudad
+pronosticos_por_horas = obtener_pronosticos_por_horas_lote(forecast_data_list, horas=HORAS_PRONOSTICO)
 
 # ============================================
 # CREAR DATAFRAME CON DATOS COMPLETOS
 # ============================================
-columnas = [
-    'Ciudad', 'Latitud', 'Longitud', 'Descripción del clima',
-    'Temperatura (°C)', 'Sensación térmica (°C)', 'Temperatura mínima (°C)',
-    'Temperatura máxima (°C)', 'Humedad (%)', 'Presión (hPa)',
-    'Viento (km/h)', 'Dirección del viento (°)', 'Visibilidad (km)',
-    'Ícono del clima', 'País',
-    'Pronóstico Lluvia', 'Pronóstico Tormenta', 'Pronóstico Granizo', 'Pronóstico Nieve',
-    'Prob. Lluvia (%)', 'Prob. Nieve (%)', 'Intensidad Lluvia (mm)'
-]
-
-datos = []
-eventos_por_ciudad = []
-
-for i, data in enumerate(weather_data):
-    direccion_viento = data.get('wind', {}).get('deg', 'N/A')
-    visibilidad = data.get('visibility', 0) / 1000 if data.get('visibility') else 'N/A'
-    
-    # Analizar pronóstico si está disponible
-    eventos = {
-        'lluvia': False,
-        'tormenta': False,
-        'granizo': False,
-        'nieve': False,
-        'probabilidad_lluvia_max': 0,
-        'probabilidad_nieve_max': 0,
-        'intensidad_lluvia_max': 0
-    }
-    
-    if i < len(forecast_data_list) and forecast_data_list[i]:
-        eventos = analizar_eventos_meteorologicos(forecast_data_list[i])
-    
-    eventos_por_ciudad.append(eventos)
-    
-    # Determinar texto de pronóstico
-    pronosticos = []
-    if eventos['lluvia']:
-        pronosticos.append('🌧️ Lluvia')
-    if eventos['tormenta']:
-        pronosticos.append('⛈️ Tormenta')
-    if eventos['granizo']:
-        pronosticos.append('🧊 Granizo')
-    if eventos['nieve']:
-        pronosticos.append('❄️ Nieve')
-    
-    pronostico_texto = ', '.join(pronosticos) if pronosticos else 'Sin eventos'
-    
-    datos.append([
-        data['name'],
-        data['coord']['lat'],
-        data['coord']['lon'],
-        data['weather'][0]['description'],
-        data['main']['temp'],
-        data['main'].get('feels_like', 'N/A'),
-        data['main']['temp_min'],
-        data['main']['temp_max'],
-        data['main']['humidity'],
-        data['main']['pressure'],
-        data['wind']['speed'] * 3.6,
-        direccion_viento,
-        visibilidad,
-        data['weather'][0]['icon'],
-        data['sys']['country'],
-        'Sí' if eventos['lluvia'] else 'No',
-        'Sí' if eventos['tormenta'] else 'No',
-        'Sí' if eventos['granizo'] else 'No',
-        'Sí' if eventos['nieve'] else 'No',
-        f"{eventos['probabilidad_lluvia_max']:.0f}%" if eventos['probabilidad_lluvia_max'] > 0 else 'N/A',
-        f"{eventos['probabilidad_nieve_max']:.0f}%" if eventos['probabilidad_nieve_max'] > 0 else 'N/A',
-        f"{eventos['intensidad_lluvia_max']:.2f}" if eventos['intensidad_lluvia_max'] > 0 else 'N/A'
-    ])
-
-df = pd.DataFrame(datos, columns=columnas)
+# Cacheado: en los reruns por interacción (expanders, sidebar) con los mismos datos no se
+# vuelve a construir. Las respuestas solo cambian con la ventana de caché, al forzar una
+# nueva consulta o cuando una ciudad pasa a tener datos (o los pierde), y eso es la clave
+clave_datos = (
+    pais_seleccionado, ventana, ventana_pronostico, refrescos().get(pais_seleccionado, 0),
+    tuple((data['id'], data.get('dt')) for data in weather_data),
+    tuple(forecast is not None for forecast in forecast_data_list)
+)
+df, eventos_por_ciudad, hay_eventos = construir_dataframe(clave_datos, weather_data, forecast_data_list)
 
 # ============================================
 # MAPA INTERACTIVO (PRIMERO)
 # ============================================
 st.header(f"🗺️ Mapa Interactivo - {pais_seleccionado}")
 
-lat_centro = df['Latitud'].mean()
-lon_centro = df['Longitud'].mean()
-
-m = folium.Map(
-    location=[lat_centro, lon_centro],
-    zoom_start=6,
-    tiles='OpenStreetMap'
-)
-
-# Capa de calor
-heat_data = [[row['Latitud'], row['Longitud'], row['Temperatura (°C)']] 
-             for idx, row in df.iterrows()]
-HeatMap(heat_data, radius=25, blur=15, max_zoom=1).add_to(m)
-
-# Marcadores
-marker_cluster = MarkerCluster().add_to(m)
-
-for idx, row in df.iterrows():
-    temp = row['Temperatura (°C)']
-    eventos = eventos_por_ciudad[idx]
-    
-    # Determinar color según temperatura
-    if temp < 10:
-        color = 'blue'
-    elif temp < 20:
-        color = 'green'
-    elif temp < 30:
-        color = 'orange'
-    else:
-        color = 'red'
-    
-    # Determinar icono según eventos meteorológicos
-    if eventos['granizo']:
-        icon = 'exclamation-triangle'
-        color = 'red'
-    elif eventos['tormenta']:
-        icon = 'bolt'
-        color = 'purple'
-    elif eventos['nieve']:
-        icon = 'snowflake'
-        color = 'lightblue'
-    elif eventos['lluvia']:
-        icon = 'tint'
-        color = 'blue'
-    else:
-        icon = 'cloud'
-    
-    # Construir texto de pronóstico para el popup
-    pronosticos_popup = []
-    if eventos['lluvia']:
-        pronosticos_popup.append(f"🌧️ Lluvia ({eventos['probabilidad_lluvia_max']:.0f}%)")
-    if eventos['tormenta']:
-        pronosticos_popup.append("⛈️ Tormenta")
-    if eventos['granizo']:
-        pronosticos_popup.append("🧊 Granizo")
-    if eventos['nieve']:
-        pronosticos_popup.append(f"❄️ Nieve ({eventos['probabilidad_nieve_max']:.0f}%)")
-    
-    pronostico_texto = '<br>'.join(pronosticos_popup) if pronosticos_popup else 'Sin eventos pronosticados'
-    
-    popup_html = f"""
-    <div style="font-family: Arial; width: 280px;">
-        <h3 style="margin: 5px 0; color: #2c3e50;">{row['Ciudad']}</h3>
-        <hr style="margin: 5px 0;">
-        <p style="margin: 3px 0;"><b>🌡️ Temperatura:</b> {row['Temperatura (°C)']:.1f}°C</p>
-        <p style="margin: 3px 0;"><b>🌤️ Estado:</b> {row['Descripción del clima']}</p>
-        <p style="margin: 3px 0;"><b>💧 Humedad:</b> {row['Humedad (%)']}%</p>
-        <p style="margin: 3px 0;"><b>💨 Viento:</b> {row['Viento (km/h)']:.1f} km/h</p>
-        <p style="margin: 3px 0;"><b>📊 Presión:</b> {row['Presión (hPa)']} hPa</p>
-        <hr style="margin: 8px 0;">
-        <p style="margin: 3px 0;"><b>📅 Pronóstico (5 días):</b></p>
-        <p style="margin: 3px 0; color: {'#d32f2f' if eventos['tormenta'] or eventos['granizo'] else '#1976d2'};">
-            {pronostico_texto}
-        </p>
-    </div>
-    """
-    
-    # Tooltip con información de pronóstico
-    tooltip_text = f"{row['Ciudad']}: {row['Temperatura (°C)']:.1f}°C"
-    if eventos['lluvia'] or eventos['tormenta'] or eventos['granizo'] or eventos['nieve']:
-        tooltip_text += " ⚠️"
-    
-    folium.Marker(
-        location=[row['Latitud'], row['Longitud']],
-        popup=folium.Popup(popup_html, max_width=300),
-        icon=folium.Icon(color=color, icon=icon, prefix='fa'),
-        tooltip=tooltip_text
-    ).add_to(marker_cluster)
-
-# Mostrar mapa en Streamlit
-import tempfile
-import os
-
-with tempfile.NamedTemporaryFile(delete=False, suffix='.html') as tmp_file:
-    m.save(tmp_file.name)
-    with open(tmp_file.name, 'r', encoding='utf-8') as f:
-        map_html = f.read()
-    os.unlink(tmp_file.name)
-
-st.components.v1.html(map_html, height=600, scrolling=True)
+# Solo las columnas que usa el mapa forman parte de la clave de caché
+columnas_mapa = ['Ciudad', 'Latitud', 'Longitud', 'Temperatura (°C)', 'Descripción del clima',
+                 'Humedad (%)', 'Viento (km/h)', 'Presión (hPa)']
+st.components.v1.html(construir_mapa_html(df[columnas_mapa], eventos_por_ciudad), height=600, scrolling=True)
 
 # ============================================
 # CONDICIONES ACTUALES (SEGUNDO)
@@ -676,42 +994,12 @@ if len(df) > 1 and not ciudad_personalizada_data:
 # ============================================
 st.header(f"⚠️ Alertas de Pronóstico - {pais_seleccionado} (Próximos 5 días)")
 
-ciudades_con_eventos = []
-for i, eventos in enumerate(eventos_por_ciudad):
-    if eventos['lluvia'] or eventos['tormenta'] or eventos['granizo'] or eventos['nieve']:
-        ciudades_con_eventos.append((df.iloc[i]['Ciudad'], eventos))
+ciudades_con_eventos = [(ciudad, eventos) for ciudad, eventos, hay in zip(df['Ciudad'], eventos_por_ciudad, hay_eventos) if hay]
 
 if ciudades_con_eventos:
     for ciudad, eventos in ciudades_con_eventos:
         with st.expander(f"🌍 {ciudad}", expanded=False):
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                if eventos['lluvia']:
-                    st.warning(f"🌧️ **Lluvia pronosticada**")
-                    if eventos['probabilidad_lluvia_max'] > 0:
-                        st.write(f"   Probabilidad máxima: {eventos['probabilidad_lluvia_max']:.0f}%")
-                    if eventos['intensidad_lluvia_max'] > 0:
-                        st.write(f"   Intensidad máxima: {eventos['intensidad_lluvia_max']:.2f} mm")
-                    if eventos['horas_lluvia']:
-                        st.write(f"   Horarios: {', '.join(eventos['horas_lluvia'][:3])}...")
-                
-                if eventos['tormenta']:
-                    st.error(f"⛈️ **Tormenta pronosticada**")
-                    if eventos['horas_tormenta']:
-                        st.write(f"   Horarios: {', '.join(eventos['horas_tormenta'][:3])}...")
-            
-            with col2:
-                if eventos['granizo']:
-                    st.error(f"🧊 **Granizo pronosticado**")
-                    st.write("   ⚠️ Precaución: riesgo de granizo")
-                
-                if eventos['nieve']:
-                    st.info(f"❄️ **Nieve pronosticada**")
-                    if eventos['probabilidad_nieve_max'] > 0:
-                        st.write(f"   Probabilidad máxima: {eventos['probabilidad_nieve_max']:.0f}%")
-                    if eventos['horas_nieve']:
-                        st.write(f"   Horarios: {', '.join(eventos['horas_nieve'][:3])}...")
+            mostrar_alertas(eventos)
 else:
     st.success("✅ No se pronostican eventos meteorológicos significativos en las próximas ciudades")
 
@@ -738,54 +1026,7 @@ if ciudad_personalizada_data:
     if ciudad_personalizada_pronosticos:
         st.subheader("⏰ Pronóstico por Horas")
         st.caption("ℹ️ Las horas mostradas son en UTC (hora Z)")
-        horas = ['6h', '12h', '18h', '24h', '36h', '48h']
-        cols = st.columns(6)
-        
-        for i, hora in enumerate(horas):
-            with cols[i]:
-                if hora in ciudad_personalizada_pronosticos:
-                    p = ciudad_personalizada_pronosticos[hora]
-                    
-                    # Determinar emoji según condiciones
-                    emoji = "☀️"
-                    color_bg = "#E8F5E9"
-                    
-                    if 'thunderstorm' in p['main'] or 'tormenta' in p['description']:
-                        emoji = "⛈️"
-                        color_bg = "#FFEBEE"
-                    elif 'rain' in p['main'] or 'lluvia' in p['description'] or p['lluvia_3h'] > 0:
-                        emoji = "🌧️"
-                        color_bg = "#E3F2FD"
-                    elif 'snow' in p['main'] or 'nieve' in p['description'] or p['nieve_3h'] > 0:
-                        emoji = "❄️"
-                        color_bg = "#E1F5FE"
-                    elif 'hail' in p['description'] or 'granizo' in p['description']:
-                        emoji = "🧊"
-                        color_bg = "#FFF3E0"
-                    elif 'cloud' in p['main']:
-                        emoji = "☁️"
-                        color_bg = "#F5F5F5"
-                    
-                    # Construir el HTML correctamente
-                    lluvia_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #1976d2;'>🌧️ {p['probabilidad_lluvia']:.0f}%</p>" if p['probabilidad_lluvia'] > 0 else ""
-                    lluvia_mm_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #1976d2;'>💧 {p['lluvia_3h']:.1f}mm</p>" if p['lluvia_3h'] > 0 else ""
-                    nieve_mm_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #64B5F6;'>❄️ {p['nieve_3h']:.1f}mm</p>" if p['nieve_3h'] > 0 else ""
-                    
-                    fecha_formateada = p['fecha'][:16] if 'fecha' in p else "N/D"
-                    html_content = f"""<div style="background-color: {color_bg}; padding: 10px; border-radius: 8px; text-align: center;">
-<h4 style="margin: 5px 0;">{hora}</h4>
-<p style="font-size: 24px; margin: 5px 0;">{emoji}</p>
-<p style="margin: 3px 0; font-weight: bold;">{p['temperatura']:.1f}°C</p>
-<p style="margin: 3px 0; font-size: 0.85em;">{p['descripcion'].title()}</p>
-<p style="margin: 3px 0; font-size: 0.8em;">💧 {p['humedad']}%</p>
-<p style="margin: 3px 0; font-size: 0.8em;">💨 {p['viento']:.1f} km/h</p>
-{lluvia_html}
-{lluvia_mm_html}
-{nieve_mm_html}
-<p style="margin: 5px 0; font-size: 0.75em; color: #666;">{fecha_formateada} UTC</p>
-</div>"""
-                    
-                    st.markdown(html_content, unsafe_allow_html=True)
+        st.markdown(tarjetas_pronostico_html(ciudad_personalizada_pronosticos), unsafe_allow_html=True)
     
     # Analizar eventos para ciudad personalizada
     if ciudad_personalizada_forecast:
@@ -793,28 +1034,7 @@ if ciudad_personalizada_data:
         
         if eventos_personalizada['lluvia'] or eventos_personalizada['tormenta'] or eventos_personalizada['granizo'] or eventos_personalizada['nieve']:
             st.subheader("⚠️ Alertas de Pronóstico")
-            alert_cols = st.columns(2)
-            
-            with alert_cols[0]:
-                if eventos_personalizada['lluvia']:
-                    st.warning(f"🌧️ **Lluvia pronosticada**")
-                    if eventos_personalizada['probabilidad_lluvia_max'] > 0:
-                        st.write(f"   Probabilidad máxima: {eventos_personalizada['probabilidad_lluvia_max']:.0f}%")
-                    if eventos_personalizada['intensidad_lluvia_max'] > 0:
-                        st.write(f"   Intensidad máxima: {eventos_personalizada['intensidad_lluvia_max']:.2f} mm")
-                
-                if eventos_personalizada['tormenta']:
-                    st.error(f"⛈️ **Tormenta pronosticada**")
-            
-            with alert_cols[1]:
-                if eventos_personalizada['granizo']:
-                    st.error(f"🧊 **Granizo pronosticado**")
-                    st.write("   ⚠️ Precaución: riesgo de granizo")
-                
-                if eventos_personalizada['nieve']:
-                    st.info(f"❄️ **Nieve pronosticada**")
-                    if eventos_personalizada['probabilidad_nieve_max'] > 0:
-                        st.write(f"   Probabilidad máxima: {eventos_personalizada['probabilidad_nieve_max']:.0f}%")
+            mostrar_alertas(eventos_personalizada, con_horarios=False)
     
     st.markdown("---")
 
@@ -825,7 +1045,7 @@ st.header(f"⏰ Pronósticos por Horas - {pais_seleccionado} (6, 12, 18, 24, 36,
 st.caption("ℹ️ Las horas mostradas son en UTC (hora Z)")
 
 # Verificar si hay pronósticos disponibles
-pronosticos_disponibles = any(pronosticos_por_horas) and any(p for p in pronosticos_por_horas if p)
+pronosticos_disponibles = any(pronosticos_por_horas)
 
 if not pronosticos_disponibles:
     st.warning("⚠️ **Pronósticos no disponibles**")
@@ -835,67 +1055,29 @@ if not pronosticos_disponibles:
            "- Problemas temporales de conexión\n\n"
            "Los datos actuales están disponibles arriba.")
 else:
-    for idx, row in df.iterrows():
-        ciudad = row['Ciudad']
-        pronosticos = pronosticos_por_horas[idx] if idx < len(pronosticos_por_horas) else {}
-        
+    for ciudad, pronosticos in zip(df['Ciudad'], pronosticos_por_horas):
         if pronosticos:
             with st.expander(f"🌍 {ciudad}", expanded=False):
-                horas = ['6h', '12h', '18h', '24h', '36h', '48h']
-                cols = st.columns(6)
-            
-            for i, hora in enumerate(horas):
-                with cols[i]:
-                    if hora in pronosticos:
-                        p = pronosticos[hora]
-                        
-                        # Determinar emoji según condiciones
-                        emoji = "☀️"
-                        color_bg = "#E8F5E9"  # Verde claro
-                        
-                        if 'thunderstorm' in p['main'] or 'tormenta' in p['description']:
-                            emoji = "⛈️"
-                            color_bg = "#FFEBEE"  # Rojo claro
-                        elif 'rain' in p['main'] or 'lluvia' in p['description'] or p['lluvia_3h'] > 0:
-                            emoji = "🌧️"
-                            color_bg = "#E3F2FD"  # Azul claro
-                        elif 'snow' in p['main'] or 'nieve' in p['description'] or p['nieve_3h'] > 0:
-                            emoji = "❄️"
-                            color_bg = "#E1F5FE"  # Azul muy claro
-                        elif 'hail' in p['description'] or 'granizo' in p['description']:
-                            emoji = "🧊"
-                            color_bg = "#FFF3E0"  # Naranja claro
-                        elif 'cloud' in p['main']:
-                            emoji = "☁️"
-                            color_bg = "#F5F5F5"  # Gris claro
-                        
-                        # Construir el HTML correctamente
-                        lluvia_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #1976d2;'>🌧️ {p['probabilidad_lluvia']:.0f}%</p>" if p['probabilidad_lluvia'] > 0 else ""
-                        lluvia_mm_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #1976d2;'>💧 {p['lluvia_3h']:.1f}mm</p>" if p['lluvia_3h'] > 0 else ""
-                        nieve_mm_html = f"<p style='margin: 3px 0; font-size: 0.8em; color: #64B5F6;'>❄️ {p['nieve_3h']:.1f}mm</p>" if p['nieve_3h'] > 0 else ""
-                        
-                        fecha_formateada = p['fecha'][:16] if 'fecha' in p else "N/D"
-                        html_content = f"""<div style="background-color: {color_bg}; padding: 10px; border-radius: 8px; text-align: center;">
-<h4 style="margin: 5px 0;">{hora}</h4>
-<p style="font-size: 24px; margin: 5px 0;">{emoji}</p>
-<p style="margin: 3px 0; font-weight: bold;">{p['temperatura']:.1f}°C</p>
-<p style="margin: 3px 0; font-size: 0.85em;">{p['descripcion'].title()}</p>
-<p style="margin: 3px 0; font-size: 0.8em;">💧 {p['humedad']}%</p>
-<p style="margin: 3px 0; font-size: 0.8em;">💨 {p['viento']:.1f} km/h</p>
-{lluvia_html}
-{lluvia_mm_html}
-{nieve_mm_html}
-<p style="margin: 5px 0; font-size: 0.75em; color: #666;">{fecha_formateada} UTC</p>
-</div>"""
-                        
-                        st.markdown(html_content, unsafe_allow_html=True)
-                    else:
-                        st.info("N/D")
+                st.markdown(tarjetas_pronostico_html(pronosticos), unsafe_allow_html=True)
         else:
             with st.expander(f"🌍 {ciudad}", expanded=False):
                 st.warning("⚠️ No hay datos de pronóstico disponibles para esta ciudad")
                 st.info("💡 Esto puede deberse a límites de la API o problemas temporales. Los datos actuales están disponibles arriba.")
 
+# ============================================
+# MAPA DE ISOTERMAS
+# ============================================
+st.header(f"🌡️ Mapa de Isotermas - {pais_seleccionado}")
+
+# Con ciudades alineadas (o repetidas) no hay área que interpolar: el ajuste sería degenerado
+posiciones_ciudades = df[['Latitud', 'Longitud']].to_numpy()
+if len(df) < 3:  # Necesitamos al menos 3 puntos para interpolación
+    st.info("ℹ️ Se necesitan al menos 3 ciudades para crear el mapa de isotermas")
+elif np.linalg.matrix_rank(posiciones_ciudades - posiciones_ciudades.mean(axis=0)) < 2:
+    st.info("ℹ️ Las ciudades están alineadas: no cubren un área suficiente para el mapa de isotermas")
+else:
+    st.image(renderizar_isotermas_png(df[['Ciudad', 'Latitud', 'Longitud', 'Temperatura (°C)']], pais_seleccionado))
+
 # ============================================
 # FOOTER
 # ============================================